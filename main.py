@@ -1,20 +1,42 @@
+import argparse
+import asyncio
+import functools
+import httpx2
 import openai
 import json
+import logging
+import logging.handlers
 import os
-import re
+import queue
+import sys
+import threading
+import tiktoken
+from aiolimiter import AsyncLimiter
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_random_exponential
+from typing import TextIO
 from dotenv import load_dotenv
 
+# tools.py reads its settings from the environment at import time, so .env has to be loaded first.
+load_dotenv()
+
+log = logging.getLogger("agent")
+
 try:
     import tools
 except ImportError:
     print("Error: tools.py not found or there's an issue importing it.")
-    print("Please ensure tools.py is in the same directory and all its dependencies are installed (chromadb, requests, beautifulsoup4).")
+    print("Please ensure tools.py is in the same directory and all its dependencies are installed (chromadb, requests, lxml).")
     exit()
 
-load_dotenv()
-
 API_KEY = os.getenv("OPENAI_API_KEY")
 MODEL_NAME = os.getenv("OPENAI_MODEL_NAME", "gpt-3.5-turbo")
+BATCH_CONCURRENCY = int(os.getenv("AGENT_BATCH_CONCURRENCY", "4"))
+MAX_HISTORY_TOKENS = int(os.getenv("MAX_HISTORY_TOKENS", "3000"))
+HISTORY_SUMMARY_EVERY = int(os.getenv("HISTORY_SUMMARY_EVERY", "3"))
+MAX_CTX_TOKENS = int(os.getenv("MAX_CTX_TOKENS", "3000"))
+MAX_DOC_DISTANCE = float(os.getenv("MAX_DOC_DISTANCE", "0.8"))
+OPENAI_MAX_RPM = int(os.getenv("OPENAI_MAX_RPM", "500"))
+OPENAI_MAX_TPM = int(os.getenv("OPENAI_MAX_TPM", "200000"))
 
 if not API_KEY:
     print("Error: The OPENAI_API_KEY environment variable is not set.")
@@ -22,60 +44,417 @@ if not API_KEY:
     exit()
 
 try:
-    client = openai.OpenAI(api_key=API_KEY)
+    # One long-lived HTTP/2 connection pool: both requests of a VDB turn share a TCP/TLS connection and
+    # idle chat sessions keep it warm for up to 5 minutes.
+    http_client = openai.DefaultAsyncHttpxClient(
+        http2=True,
+        limits=httpx2.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=300),
+        timeout=openai.Timeout(60.0, connect=5.0)
+    )
+    # Retries are handled by create_chat_completion, so the SDK's own retry loop is disabled.
+    client = openai.AsyncOpenAI(api_key=API_KEY, max_retries=0, http_client=http_client)
 except openai.OpenAIError as e:
     print(f"OpenAI API client initialization error: {e}")
     exit()
 
-SCRAPE_URL_PREFIX = "TOOL_REQUEST: scrape_url(url="
-GET_FROM_VDB_PREFIX = "TOOL_REQUEST: get_from_vdb("
-TOOL_REQUEST_SUFFIX = ")"
+request_limiter = AsyncLimiter(OPENAI_MAX_RPM, 60)
+token_limiter = AsyncLimiter(OPENAI_MAX_TPM, 60)
+
+SUMMARY_PREFIX = "Summary of earlier conversation: "
+
+SCRAPE_URL_TOOL = "scrape_url"
+GET_FROM_VDB_TOOL = "get_from_vdb"
+
+TOOLS = [
+    {
+        "type": "function",
+        "function": {
+            "name": SCRAPE_URL_TOOL,
+            "description": "Scrape one or more web pages and store their content in the Vector Database (VDB) for later questions. "
+                           "Use it when the user provides URLs that should be processed; pass all of them in a single call.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "urls": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": "The full URLs to scrape."
+                    }
+                },
+                "required": ["urls"],
+                "additionalProperties": False
+            },
+            "strict": True
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": GET_FROM_VDB_TOOL,
+            "description": "Search the VDB for content from previously scraped URLs. "
+                           "Use it when the answer to the user's question might be in a page that was processed before.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "query": {"type": "string", "description": "The search query."},
+                    "category": {
+                        "type": "string",
+                        "description": "The VDB category of the website. It is derived from the hostname by removing any leading 'www.', "
+                                       "then the top-level domain extension, and replacing dots with underscores "
+                                       "(e.g. 'www.fib.upc.edu' -> 'fib_upc', 'www.another.domain.co.uk' -> 'another_domain_co')."
+                    }
+                },
+                "required": ["query", "category"],
+                "additionalProperties": False
+            },
+            "strict": True
+        }
+    }
+]
+
+
+# Kept byte-for-byte identical across turns and free of per-run values, so together with TOOLS it forms a
+# stable request prefix that OpenAI's automatic prompt caching can reuse.
+SYSTEM_PROMPT = (
+    "You are a helpful assistant. "
+    f"Use the {SCRAPE_URL_TOOL} tool when the user provides URLs that should be scraped and stored for later, "
+    f"and the {GET_FROM_VDB_TOOL} tool when the answer might be in the VDB from previously processed URLs. "
+    "Otherwise, answer the user directly."
+)
+
+
+def new_conversation() -> list[dict]:
+    return [{"role": "system", "content": SYSTEM_PROMPT}]
+
+
+def report_prompt_cache(usage):
+    details = getattr(usage, "prompt_tokens_details", None) if usage else None
+    if details is not None and details.cached_tokens:
+        log.debug("Prompt cache hit: %d/%d prompt tokens cached.", details.cached_tokens, usage.prompt_tokens)
+
+
+@functools.lru_cache(maxsize=None)
+def get_encoding() -> tiktoken.Encoding | None:
+    """The model's tokenizer, or None if it cannot be loaded (tiktoken downloads it on first use).
+
+    The outcome is cached either way, so an offline run tries the download once and then estimates
+    about 4 characters per token. main() loads it off the event loop before the first turn.
+    """
+    try:
+        try:
+            return tiktoken.encoding_for_model(MODEL_NAME)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        log.warning("Could not load the tokenizer, estimating token counts from text length: %s", e)
+        return None
+
+
+def count_text_tokens(text: str) -> int:
+    encoding = get_encoding()
+    return len(encoding.encode(text)) if encoding is not None else len(text) // 4
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    encoding = get_encoding()
+    if encoding is None:
+        return text[:max_tokens * 4]
+    return encoding.decode(encoding.encode(text)[:max_tokens])
+
+
+def count_tokens(messages: list[dict]) -> int:
+    # Roughly 4 tokens of per-message framing on top of the content, as in OpenAI's cookbook estimate.
+    return sum(count_text_tokens(message.get("content") or "") + 4 for message in messages)
+
+
+_backoff = wait_random_exponential(min=1, max=30)
+
+
+def wait_retry_after(retry_state) -> float:
+    """Honors the Retry-After header of a 429/5xx response, falling back to jittered exponential backoff."""
+    response = getattr(retry_state.outcome.exception(), "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(retry_after)
+    except (TypeError, ValueError):
+        return _backoff(retry_state)
+
+
+@retry(
+    wait=wait_retry_after,
+    stop=stop_after_attempt(6),
+    retry=retry_if_exception_type((openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)),
+    reraise=True
+)
+async def create_chat_completion(messages: list[dict], **kwargs):
+    """Calls chat.completions.create for MODEL_NAME, throttled to OPENAI_MAX_RPM requests and OPENAI_MAX_TPM tokens per minute."""
+    estimated_tokens = min(count_tokens(messages), OPENAI_MAX_TPM)
+    if kwargs.get("stream"):
+        # Without this a stream carries no usage, and its output tokens would never be charged.
+        kwargs.setdefault("stream_options", {"include_usage": True})
+    await token_limiter.acquire(estimated_tokens)
+    async with request_limiter:
+        response = await client.chat.completions.create(model=MODEL_NAME, messages=messages, **kwargs)
+    if kwargs.get("stream"):
+        return charge_stream_usage(response, estimated_tokens)
+    await charge_usage(getattr(response, "usage", None), estimated_tokens)
+    return response
+
+
+async def charge_usage(usage, estimated_tokens: int):
+    """Takes the tokens a request used beyond its estimate from token_limiter."""
+    if usage is not None and usage.total_tokens > estimated_tokens:
+        await token_limiter.acquire(min(usage.total_tokens - estimated_tokens, OPENAI_MAX_TPM))
+
+
+async def charge_stream_usage(stream, estimated_tokens: int):
+    """Passes a streamed completion's chunks through, charging its usage once the final chunk reports it."""
+    async for chunk in stream:
+        await charge_usage(getattr(chunk, "usage", None), estimated_tokens)
+        yield chunk
+
+
+def build_vdb_context(documents: list[str], distances: list[float] | None) -> str:
+    """Joins VDB documents (closest first) into the synthesis context.
+
+    Documents farther than MAX_DOC_DISTANCE are dropped, and the rest are added until MAX_CTX_TOKENS is
+    reached; the document that crosses the budget is truncated and ellipsized.
+    """
+    remaining_tokens = MAX_CTX_TOKENS
+    context_parts = []
+    for index, document in enumerate(documents):
+        if distances is not None and distances[index] > MAX_DOC_DISTANCE:
+            continue
+        document_tokens = count_text_tokens(document)
+        if document_tokens > remaining_tokens:
+            if remaining_tokens > 0:
+                context_parts.append(truncate_to_tokens(document, remaining_tokens) + "...")
+            break
+        context_parts.append(document)
+        remaining_tokens -= document_tokens
+    return "\n---\n".join(context_parts)
+
+
+async def summarize_messages(previous_summary: str | None, messages: list[dict]) -> str:
+    transcript = "\n".join(f"{message['role']}: {message['content']}" for message in messages)
+    if previous_summary:
+        transcript = f"Earlier summary: {previous_summary}\n{transcript}"
+    response = await create_chat_completion(
+        messages=[
+            {
+                "role": "system",
+                "content": "Summarize the following conversation in a few sentences. Keep any facts, URLs and VDB categories "
+                           "the user may refer back to."
+            },
+            {"role": "user", "content": transcript}
+        ]
+    )
+    return response.choices[0].message.content.strip()
+
+
+async def trim_history(conversation_messages: list[dict], evicted_messages: list[dict]):
+    """Keeps conversation_messages under MAX_HISTORY_TOKENS by evicting the oldest user/assistant pairs.
+
+    Evicted turns are collected in evicted_messages and, every HISTORY_SUMMARY_EVERY turns, folded into a
+    summary system message kept at index 1, right after the main system prompt.
+    """
+    has_summary = len(conversation_messages) > 1 and conversation_messages[1]["role"] == "system" \
+        and conversation_messages[1]["content"].startswith(SUMMARY_PREFIX)
+    first_turn_index = 2 if has_summary else 1
+
+    total_tokens = count_tokens(conversation_messages)
+    while total_tokens > MAX_HISTORY_TOKENS and len(conversation_messages) - first_turn_index > 2:
+        evicted_pair = conversation_messages[first_turn_index:first_turn_index + 2]
+        del conversation_messages[first_turn_index:first_turn_index + 2]
+        evicted_messages.extend(evicted_pair)
+        total_tokens -= count_tokens(evicted_pair)
+
+    if len(evicted_messages) < 2 * HISTORY_SUMMARY_EVERY:
+        return
+
+    previous_summary = conversation_messages[1]["content"].removeprefix(SUMMARY_PREFIX) if has_summary else None
+    summary = await summarize_messages(previous_summary, evicted_messages)
+    summary_message = {"role": "system", "content": SUMMARY_PREFIX + summary}
+    if has_summary:
+        conversation_messages[1] = summary_message
+    else:
+        conversation_messages.insert(1, summary_message)
+    evicted_messages.clear()
+
 
+async def synthesize_answer(messages_for_synthesis: list[dict], stream_to: TextIO | None) -> str:
+    """Asks the LLM for the final answer, writing it to stream_to token by token when given."""
+    if stream_to is None:
+        synthesis_response = await create_chat_completion(messages=messages_for_synthesis)
+        return synthesis_response.choices[0].message.content
 
-def parse_scrape_url_request(llm_output: str) -> str | None:
-    if llm_output.startswith(SCRAPE_URL_PREFIX) and llm_output.endswith(TOOL_REQUEST_SUFFIX):
+    synthesis_stream = await create_chat_completion(messages=messages_for_synthesis, stream=True)
+    stream_to.write("Agent: ")
+    response_parts = []
+    async for chunk in synthesis_stream:
+        delta = chunk.choices[0].delta.content if chunk.choices else None
+        if delta:
+            stream_to.write(delta)
+            stream_to.flush()
+            response_parts.append(delta)
+    stream_to.write("\n")
+    return "".join(response_parts)
+
+
+async def process_turn(conversation_messages: list[dict], user_input: str, stream_to: TextIO | None = None) -> str | None:
+    """Runs one user turn and records it in conversation_messages.
+
+    If stream_to is given, the agent's reply is written to it, with the VDB synthesis streamed token by token.
+    """
+    # Every outcome below records the user message, so it goes straight into the history and the
+    # first request can send conversation_messages as-is instead of a per-turn copy.
+    conversation_messages.append({"role": "user", "content": user_input})
+
+    assistant_response_for_history = None
+    already_streamed = False
+
+    try:
+        response = await create_chat_completion(
+            messages=conversation_messages,
+            tools=TOOLS,
+            parallel_tool_calls=False
+        )
+        report_prompt_cache(response.usage)
+        llm_message = response.choices[0].message
+        tool_call = llm_message.tool_calls[0] if llm_message.tool_calls else None
+        tool_name = tool_call.function.name if tool_call else None
+        tool_args = json.loads(tool_call.function.arguments) if tool_call else {}
+
+        if tool_name == SCRAPE_URL_TOOL:
+            urls = tool_args["urls"]
+            # Models occasionally send a lone URL as a string; deduping that would split it into characters.
+            urls_to_scrape = list(dict.fromkeys([urls] if isinstance(urls, str) else urls))
+            log.debug("LLM identified URLs for scraping: %s", urls_to_scrape)
+            already_indexed = await asyncio.gather(*(asyncio.to_thread(tools.is_url_indexed, url) for url in urls_to_scrape))
+            new_urls = [url for url, indexed in zip(urls_to_scrape, already_indexed) if not indexed]
+            doc_ids_by_url = {}
+            if new_urls:
+                log.debug("Calling tools.scrape_and_embed_websites_async with URLs: %s", new_urls)
+                doc_ids_by_url = await tools.scrape_and_embed_websites_async(new_urls)
+
+            scrape_reports = []
+            for url in urls_to_scrape:
+                if url not in doc_ids_by_url:
+                    scrape_reports.append(f"The URL {url} is already indexed in the VDB, so its content is available for questions.")
+                elif doc_ids_by_url[url]:
+                    scrape_reports.append(f"I have processed the URL {url}. Its content (found {len(doc_ids_by_url[url])} chunks) has been scraped and stored in the VDB.")
+                else:
+                    scrape_reports.append(f"I attempted to process the URL {url}, but failed to scrape or embed any content. It might be inaccessible or have no extractable text.")
+            if any(doc_ids_by_url.values()):
+                scrape_reports.insert(0, "Understood.")
+            assistant_response_for_history = " ".join(scrape_reports)
+
+        elif tool_name == GET_FROM_VDB_TOOL:
+            vdb_query, vdb_category = tool_args["query"], tool_args["category"]
+            log.debug("LLM requested VDB search; calling tools.query_information with query: \"%s\", category: \"%s\"", vdb_query, vdb_category)
+            vdb_info_dict = await asyncio.to_thread(tools.query_information, query_text=vdb_query, category=vdb_category)
+
+            docs_list = vdb_info_dict.get('documents')
+            vdb_context = ""
+
+            if vdb_info_dict.get('error'):
+                log.debug("VDB error for query '%s' in category '%s': %s", vdb_query, vdb_category, vdb_info_dict.get('error'))
+            elif docs_list and isinstance(docs_list, list) and len(docs_list) > 0 and isinstance(docs_list[0], list) and docs_list[0]:
+                distances_list = vdb_info_dict.get('distances')
+                vdb_context = build_vdb_context(docs_list[0], distances_list[0] if distances_list else None)
+                if vdb_context:
+                    log.debug("VDB Results (snippet): \"%.150s...\"", vdb_context)
+                else:
+                    log.debug("All VDB results for query '%s' in category '%s' were beyond the distance threshold (%s).", vdb_query, vdb_category, MAX_DOC_DISTANCE)
+            else:
+                log.debug("VDB returned no documents or an unexpected format for query: '%s' in category '%s'. Full response: %s", vdb_query, vdb_category, vdb_info_dict)
+
+            if not vdb_context:
+                # Nothing to ground an answer on: reply directly instead of paying for a synthesis round-trip.
+                assistant_response_for_history = f"I don't have information about that in my knowledge base yet (searched the \"{vdb_category}\" category). You can give me a URL to scrape first."
+            else:
+                messages_for_synthesis = [
+                    *conversation_messages,
+                    {"role": "assistant", "content": llm_message.content, "tool_calls": [tool_call.model_dump()]},
+                    {
+                        "role": "tool",
+                        "tool_call_id": tool_call.id,
+                        "content": f"The VDB returned the following information:\n---\n{vdb_context}\n---\n"
+                                   f"Based on this, please now provide a comprehensive answer to the user's original question: \"{user_input}\". "
+                                   "Answer directly without mentioning the VDB search process."
+                    }
+                ]
+
+                log.debug("Asking LLM to synthesize answer using VDB results...")
+                assistant_response_for_history = await synthesize_answer(messages_for_synthesis, stream_to)
+                already_streamed = stream_to is not None
+
+        else:
+            assistant_response_for_history = (llm_message.content or "").strip()
+
+        if stream_to is not None and not already_streamed:
+            stream_to.write(f"Agent: {assistant_response_for_history}\n")
+
+        if assistant_response_for_history is not None:
+             conversation_messages.append({"role": "assistant", "content": assistant_response_for_history})
+        else:
+             conversation_messages.append({"role": "assistant", "content": "I encountered an issue processing that request fully."})
+
+    except openai.APIError as e:
+        log.error("OpenAI API Error: %s", e)
+        conversation_messages.append({"role": "assistant", "content": "Sorry, I encountered an API error."})
+    except Exception as e:
+        log.error("An unexpected error occurred: %s", e)
+        conversation_messages.append({"role": "assistant", "content": "Sorry, an unexpected error occurred."})
+
+    return assistant_response_for_history
+
+
+async def read_line(prompt: str) -> str:
+    """input() on a daemon thread, so Ctrl-C at the prompt can end the program.
+
+    asyncio.run() joins its default executor on shutdown, so a to_thread() read stuck in input() would keep
+    the process alive until Enter is pressed.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def resolve(setter, value):
+        if not future.done():
+            setter(value)
+
+    def read():
+        try:
+            line = input(prompt)
+        except BaseException as e:
+            setter, value = future.set_exception, e
+        else:
+            setter, value = future.set_result, line
         try:
-            content_part = llm_output[len(SCRAPE_URL_PREFIX):-len(TOOL_REQUEST_SUFFIX)]
-            if content_part.startswith('"') and content_part.endswith('"'):
-                return content_part[1:-1]
-        except Exception:
-            return None
-    return None
-
-def parse_get_from_vdb_request(llm_output: str) -> tuple[str, str] | None:
-    if llm_output.startswith(GET_FROM_VDB_PREFIX) and llm_output.endswith(TOOL_REQUEST_SUFFIX):
-        args_str = llm_output[len(GET_FROM_VDB_PREFIX):-len(TOOL_REQUEST_SUFFIX)]
-        query_match = re.search(r'query="([^"]*)"', args_str)
-        category_match = re.search(r'category="([^"]*)"', args_str)
-        if query_match and category_match:
-            query = query_match.group(1)
-            category = category_match.group(1)
-            return query, category
-    return None
-
-
-def run_chat_loop():
+            loop.call_soon_threadsafe(resolve, setter, value)
+        except RuntimeError:
+            pass  # The loop has already closed; nobody is waiting for the line.
+
+    threading.Thread(target=read, name="stdin-reader", daemon=True).start()
+    return await future
+
+
+async def run_chat_loop():
     print(f"Simple Agent CLI (using model: {MODEL_NAME}, with real tools.py)")
     print("Enter a URL for the LLM to consider scraping, or ask a question.")
-    print(f"LLM uses: {SCRAPE_URL_PREFIX}\"URL_HERE\"{TOOL_REQUEST_SUFFIX} for scraping.")
-    print(f"LLM uses: {GET_FROM_VDB_PREFIX}query=\"QUERY_HERE\", category=\"DERIVED_CATEGORY_HERE\"{TOOL_REQUEST_SUFFIX} for VDB search.")
+    print(f"LLM uses the {SCRAPE_URL_TOOL}(urls) tool for scraping.")
+    print(f"LLM uses the {GET_FROM_VDB_TOOL}(query, category) tool for VDB search.")
     print("Type 'exit' or 'quit' to end.")
 
-    system_message_content = (
-        f"You are a helpful assistant using the {MODEL_NAME} model. You have two tools available.\n"
-        "1. URL Scraper: If the user provides text that you identify as a URL that should be processed (scraped and its content stored for later), "
-        f"you MUST respond with ONLY the following exact format: {SCRAPE_URL_PREFIX}\"THE_URL_HERE\"{TOOL_REQUEST_SUFFIX}\n"
-        "When a URL is scraped, its content is automatically categorized in the Vector Database (VDB). The category name is derived from the website's hostname by first removing any leading 'www.' prefix, then removing the top-level domain extension (e.g., '.com', '.org', '.edu'). The remaining part is then sanitized (dots become underscores). For example, 'www.fib.upc.edu' would result in a category like 'fib_upc'. Remember this specific naming convention for later queries.\n"
-        "2. VDB Search: If the user asks a question and you believe the answer might be in the VDB from previously processed URLs, "
-        f"you MUST respond with ONLY the following exact format: {GET_FROM_VDB_PREFIX}query=\"YOUR_SEARCH_QUERY\", category=\"DERIVED_CATEGORY_NAME\"{TOOL_REQUEST_SUFFIX}\n"
-        "Replace \"YOUR_SEARCH_QUERY\" with the specific query, and \"DERIVED_CATEGORY_NAME\" with the category name formed according to the rule described above (e.g., for 'www.example.com', the category would be 'example'; for 'www.another.domain.co.uk', it would be 'another_domain_co').\n"
-        "IMPORTANT: If you decide to use a tool, your response must consist *only* of the tool request string. Do not add any other text or explanation.\n"
-        "If you can answer directly or the input is not a URL to scrape and does not require VDB search, then provide a direct answer to the user."
-    )
-    conversation_messages = [{"role": "system", "content": system_message_content}]
+    conversation_messages = new_conversation()
+    evicted_messages = []
 
     while True:
-        user_input = input("\nYou: ").strip()
+        try:
+            user_input = (await read_line("\nYou: ")).strip()
+        except EOFError:
+            print("\nExiting agent.")
+            break
 
         if user_input.lower() in ['exit', 'quit']:
             print("Exiting agent.")
@@ -84,85 +463,82 @@ def run_chat_loop():
         if not user_input:
             continue
 
-        current_turn_messages = list(conversation_messages)
-        current_turn_messages.append({"role": "user", "content": user_input})
-        
-        assistant_response_for_history = None
+        await process_turn(conversation_messages, user_input, stream_to=sys.stdout)
 
         try:
-            response = client.chat.completions.create(
-                model=MODEL_NAME,
-                messages=current_turn_messages
-            )
-            llm_initial_response = response.choices[0].message.content.strip()
-
-            parsed_url_to_scrape = parse_scrape_url_request(llm_initial_response)
-            parsed_vdb_params = parse_get_from_vdb_request(llm_initial_response)
-
-            if parsed_url_to_scrape:
-                print(f"AGENT: LLM identified URL for scraping: {parsed_url_to_scrape}")
-                print(f"AGENT_TOOL: Calling tools.scrape_and_embed_website with URL: {parsed_url_to_scrape}")
-                doc_ids = tools.scrape_and_embed_website(url=parsed_url_to_scrape)
-                if doc_ids:
-                    assistant_response_for_history = f"Understood. I have processed the URL {parsed_url_to_scrape}. Its content (found {len(doc_ids)} chunks) has been scraped and stored in the VDB."
-                else:
-                    assistant_response_for_history = f"I attempted to process the URL {parsed_url_to_scrape}, but failed to scrape or embed any content. It might be inaccessible or have no extractable text."
-                print(f"Agent: {assistant_response_for_history}")
-            
-            elif parsed_vdb_params:
-                vdb_query, vdb_category = parsed_vdb_params
-                print(f"AGENT: LLM requested VDB search with query: \"{vdb_query}\" in category: \"{vdb_category}\"")
-                print(f"AGENT_TOOL: Calling tools.query_information with query: \"{vdb_query}\", category: \"{vdb_category}\"")
-                
-                vdb_info_dict = tools.query_information(query_text=vdb_query, category=vdb_category)
-                
-                docs_list = vdb_info_dict.get('documents')
-                vdb_results_text = "No specific documents found in VDB for your query in that category."
-
-                if vdb_info_dict.get('error'):
-                     vdb_results_text += f" (Error from VDB: {vdb_info_dict.get('error')})"
-                elif docs_list and isinstance(docs_list, list) and len(docs_list) > 0 and isinstance(docs_list[0], list) and docs_list[0]:
-                    vdb_results_text = "\n---\n".join(docs_list[0])
-                    print(f"AGENT: VDB Results (snippet): \"{vdb_results_text[:150]}...\"")
-                else:
-                    print(f"AGENT: VDB returned no documents or an unexpected format for query: '{vdb_query}' in category '{vdb_category}'. Full response: {vdb_info_dict}")
-
-                messages_for_synthesis = list(current_turn_messages)
-                messages_for_synthesis.append({"role": "assistant", "content": llm_initial_response}) 
-                messages_for_synthesis.append({
-                    "role": "system",
-                    "content": f"You previously decided to search the VDB category \"{vdb_category}\" with the query \"{vdb_query}\". "
-                               f"The VDB returned the following information:\n---\n{vdb_results_text}\n---\n"
-                               f"Based on this, please now provide a comprehensive answer to the user's original question: \"{user_input}\". "
-                               "Answer directly without mentioning the VDB search process or tool formats."
-                })
-                
-                print("AGENT: Asking LLM to synthesize answer using VDB results...")
-                synthesis_response = client.chat.completions.create(
-                    model=MODEL_NAME,
-                    messages=messages_for_synthesis
-                )
-                assistant_response_for_history = synthesis_response.choices[0].message.content
-                print(f"Agent: {assistant_response_for_history}")
+            await trim_history(conversation_messages, evicted_messages)
+        except openai.APIError as e:
+            log.warning("OpenAI API Error while summarizing history (will retry next turn): %s", e)
+        except Exception as e:
+            log.warning("Unexpected error while trimming history (will retry next turn): %s", e)
 
-            else:
-                assistant_response_for_history = llm_initial_response
-                print(f"Agent: {assistant_response_for_history}")
 
-            conversation_messages.append({"role": "user", "content": user_input})
-            if assistant_response_for_history is not None:
-                 conversation_messages.append({"role": "assistant", "content": assistant_response_for_history})
-            else:
-                 conversation_messages.append({"role": "assistant", "content": "I encountered an issue processing that request fully."})
+async def run_batch(pending_inputs: list[str], concurrency: int = BATCH_CONCURRENCY):
+    """Runs independent prompts concurrently, each in its own conversation, and prints replies in input order."""
+    semaphore = asyncio.Semaphore(concurrency)
 
-        except openai.APIError as e:
-            print(f"OpenAI API Error: {e}")
-            conversation_messages.append({"role": "user", "content": user_input})
-            conversation_messages.append({"role": "assistant", "content": "Sorry, I encountered an API error."})
-        except Exception as e:
-            print(f"An unexpected error occurred: {e}")
-            conversation_messages.append({"role": "user", "content": user_input})
-            conversation_messages.append({"role": "assistant", "content": "Sorry, an unexpected error occurred."})
+    async def flush_one(user_input: str) -> str | None:
+        async with semaphore:
+            return await process_turn(new_conversation(), user_input)
+
+    print(f"Simple Agent batch mode (using model: {MODEL_NAME}, {len(pending_inputs)} prompts, concurrency {concurrency})")
+    results = await asyncio.gather(*(flush_one(user_input) for user_input in pending_inputs))
+    for index, (user_input, assistant_response) in enumerate(zip(pending_inputs, results), start=1):
+        print(f"\n[{index}] You: {user_input}")
+        print(f"[{index}] Agent: {assistant_response if assistant_response is not None else 'No response (see errors above).'}")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Simple agent CLI with URL scraping and VDB search tools.")
+    parser.add_argument("--batch", metavar="FILE", help="Run the prompts in FILE (one per line, '-' for stdin) concurrently instead of the interactive loop.")
+    parser.add_argument("--verbose", "-v", action="store_true", help="Log the agent's tool calls and VDB diagnostics.")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY, help=f"Maximum prompts in flight in batch mode (default: {BATCH_CONCURRENCY}).")
+    return parser.parse_args()
+
+
+def read_batch_inputs(path: str) -> list[str]:
+    if path == "-":
+        lines = sys.stdin.read().splitlines()
+    else:
+        with open(path, encoding="utf-8") as f:
+            lines = f.read().splitlines()
+    return [line.strip() for line in lines if line.strip()]
+
+
+def configure_logging(verbose: bool) -> logging.handlers.QueueListener:
+    """Routes log records through a queue so writing them to the terminal happens off the event loop thread."""
+    log_queue = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter("%(name)s: %(message)s"))
+    listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    # QueueHandler pre-formats records; keep that to the bare message so stream_handler adds the prefix once.
+    queue_handler.setFormatter(logging.Formatter("%(message)s"))
+    logging.basicConfig(level=logging.WARNING, handlers=[queue_handler])
+    if verbose:
+        log.setLevel(logging.DEBUG)
+        logging.getLogger("tools").setLevel(logging.DEBUG)
+    listener.start()
+    return listener
+
+
+async def main():
+    args = parse_args()
+    log_listener = configure_logging(args.verbose)
+    # tiktoken may download the encoding on first use; do that once here instead of inside a turn on the loop.
+    await asyncio.to_thread(get_encoding)
+    try:
+        if args.batch:
+            await run_batch(read_batch_inputs(args.batch), concurrency=max(1, args.concurrency))
+        else:
+            await run_chat_loop()
+    finally:
+        await tools.close_scrape_session()
+        await client.close()
+        log_listener.stop()
 
 if __name__ == "__main__":
-    run_chat_loop()
\ No newline at end of file
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print("\nExiting agent.")
\ No newline at end of file
@@ -1,93 +1,421 @@
+import aiohttp
+import asyncio
 import chromadb
-import uuid
+import codecs
+import hashlib
+import logging
+import numpy as np
+import os
+import threading
+import time
+from collections import OrderedDict
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from lxml import etree
 from urllib.parse import urlparse
 import re
+import sys
+from typing import Iterable, Optional
+from chromadb.api import ClientAPI
+from chromadb.api.models.Collection import Collection
+from chromadb.api.types import EmbeddingFunction
+from chromadb.utils import embedding_functions
 
-def embed_information(content: str, category: str) -> str:
-    client = chromadb.Client()
-    collection_name = category
-    collection = client.get_or_create_collection(name=collection_name)
+log = logging.getLogger(__name__)
 
-    if not content:
-        print("Content cannot be empty. No document added.")
-        return None
+QUERY_CACHE_SIMILARITY = float(os.getenv("QUERY_CACHE_SIMILARITY", "0.95"))
+QUERY_CACHE_TTL_S = float(os.getenv("QUERY_CACHE_TTL_S", "600"))
+# Per category.
+QUERY_CACHE_MAX_ENTRIES = 256
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL")
+DOCUMENTS_COLLECTION = "documents"
+# One row per scraped URL, keyed by its digest: a page whose chunks were all already stored from another URL
+# gets no document row with its own source_url, so it is recorded here instead.
+URLS_COLLECTION = "scraped_urls"
+# The VDB lives on disk, so pages embedded in earlier sessions are still there when the agent restarts.
+CHROMA_PATH = os.getenv("CHROMA_PATH", "./chroma_db")
+CHROMA_ADD_BATCH_SIZE = int(os.getenv("CHROMA_ADD_BATCH_SIZE", "200"))
+SCRAPE_CHUNK_BYTES = 64 * 1024
+CHUNK_TARGET_CHARS = int(os.getenv("CHUNK_TARGET_CHARS", "1500"))
+SCRAPE_MAX_BYTES = int(os.getenv("SCRAPE_MAX_BYTES", str(10 * 1024 * 1024)))
+SCRAPE_TIMEOUT_S = 10
+SCRAPE_META_SNIFF_BYTES = 4096
+SCRAPE_MAX_CONNECTIONS = 20
+# Connection failures and timeouts are retried this many times, waiting SCRAPE_RETRY_BACKOFF_S * 2**attempt.
+SCRAPE_RETRIES = 2
+SCRAPE_RETRY_BACKOFF_S = 0.3
+SCRAPE_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    # br is decoded transparently by requests and aiohttp once the brotli package is installed.
+    'Accept-Encoding': 'gzip, br, deflate'
+}
 
-    doc_id = str(uuid.uuid4())
-    documents_to_add = [content]
-    ids_to_add = [doc_id]
-    metadatas_to_add = [{"category": category}]
+_CATEGORY_SANITIZE_RE = re.compile(r'[^a-zA-Z0-9_-]+')
+_CHARSET_RE = re.compile(r'charset=["\']?([\w.:-]+)', re.IGNORECASE)
+_META_CHARSET_RE = re.compile(rb'<meta[^>]+charset=["\']?([\w.:-]+)', re.IGNORECASE)
 
-    collection.add(
-        documents=documents_to_add,
-        metadatas=metadatas_to_add,
-        ids=ids_to_add
-    )
-    
-    print(f"Successfully added 1 document with id '{doc_id}' to the '{collection_name}' collection.")
-    return doc_id
+# HNSW index parameters, applied when a collection is first created (existing collections keep theirs).
+HNSW_METADATA = {
+    "hnsw:space": os.getenv("CHROMA_HNSW_SPACE", "cosine"),
+    "hnsw:M": int(os.getenv("CHROMA_HNSW_M", "16")),
+    "hnsw:construction_ef": int(os.getenv("CHROMA_HNSW_CONSTRUCTION_EF", "100")),
+    "hnsw:search_ef": int(os.getenv("CHROMA_HNSW_SEARCH_EF", "50")),
+    "hnsw:num_threads": int(os.getenv("CHROMA_HNSW_NUM_THREADS", str(os.cpu_count() or 1))),
+}
 
-def query_information(query_text: str, category: str) -> dict:
-    client = chromadb.Client()
-    collection_name = category
+# Shared session for the synchronous scraper (scrape_and_embed_website), so repeat scrapes of a host reuse
+# its pooled connections. The async scraper keeps its own long-lived aiohttp session, see _get_scrape_session().
+_HTTP = requests.Session()
+_HTTP.headers.update(SCRAPE_HEADERS)
+_HTTP_ADAPTER = HTTPAdapter(pool_connections=SCRAPE_MAX_CONNECTIONS, pool_maxsize=SCRAPE_MAX_CONNECTIONS,
+                            max_retries=Retry(total=SCRAPE_RETRIES, backoff_factor=SCRAPE_RETRY_BACKOFF_S))
+_HTTP.mount("http://", _HTTP_ADAPTER)
+_HTTP.mount("https://", _HTTP_ADAPTER)
 
-    try:
-        collection = client.get_collection(name=collection_name)
-    except Exception as e:
-        print(f"Error getting collection '{collection_name}': {e}")
-        print(f"Please ensure the collection '{collection_name}' exists and has data.")
-        return {"error": str(e), "documents": [[]], "distances": [[]], "metadatas": [[]], "ids": [[]]}
+# aiohttp sessions are bound to the event loop they were created on, so a new one is opened if the loop changes.
+_SCRAPE_SESSION: Optional[aiohttp.ClientSession] = None
+
+_CLIENT: Optional[ClientAPI] = None
+_CLIENT_LOCK = threading.Lock()
+_COLLECTIONS: dict[str, Collection] = {}
+_COLLECTIONS_LOCK = threading.Lock()
+
+def _build_embedding_function():
+    # A named model (e.g. BAAI/bge-small-en-v1.5) needs sentence-transformers installed; otherwise use
+    # Chroma's bundled ONNX MiniLM, pinned to the CPU provider so onnxruntime skips provider probing.
+    if EMBEDDING_MODEL:
+        import torch  # installed with sentence-transformers
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        return embedding_functions.SentenceTransformerEmbeddingFunction(model_name=EMBEDDING_MODEL, device=device, normalize_embeddings=True)
+    return embedding_functions.ONNXMiniLM_L6_V2(preferred_providers=["CPUExecutionProvider"])
+
+# Built on first use: with EMBEDDING_MODEL set this imports torch and loads the model, which importing
+# tools.py should not pay for.
+_EMBEDDING_FUNCTION: Optional[EmbeddingFunction] = None
+_EMBEDDING_FUNCTION_LOCK = threading.Lock()
+
+# Query cache, one LRU per category: entries are keyed by a SHA-256 of the query text so exact repeats skip
+# embedding entirely, and near-duplicates are matched by cosine similarity against the normalized vectors
+# of past queries. Each entry is (timestamp, vector, results).
+_QCACHE: dict[str, OrderedDict[str, tuple[float, np.ndarray, dict]]] = {}
+# Tools run in worker threads (asyncio.to_thread), so cache reads and updates are serialized; embedding
+# and the Chroma query itself run outside the lock.
+_QCACHE_LOCK = threading.Lock()
+
+# SHA-256 digests of URLs known to be in the VDB; misses fall back to a lookup in URLS_COLLECTION.
+_SEEN_URLS: set[bytes] = set()
+
+def _get_client() -> ClientAPI:
+    global _CLIENT
+    if _CLIENT is None:
+        with _CLIENT_LOCK:
+            if _CLIENT is None:
+                _CLIENT = chromadb.PersistentClient(path=CHROMA_PATH)
+    return _CLIENT
+
+def _get_embedding_function() -> EmbeddingFunction:
+    global _EMBEDDING_FUNCTION
+    if _EMBEDDING_FUNCTION is None:
+        with _EMBEDDING_FUNCTION_LOCK:
+            if _EMBEDDING_FUNCTION is None:
+                _EMBEDDING_FUNCTION = _build_embedding_function()
+    return _EMBEDDING_FUNCTION
+
+def _coll(name: str) -> Collection:
+    collection = _COLLECTIONS.get(name)
+    if collection is None:
+        with _COLLECTIONS_LOCK:
+            collection = _COLLECTIONS.get(name)
+            if collection is None:
+                if name == URLS_COLLECTION:
+                    # Looked up by id only: no embedding function (so no model load) and a default index.
+                    collection = _get_client().get_or_create_collection(name=name, embedding_function=None)
+                else:
+                    collection = _get_client().get_or_create_collection(name=name, embedding_function=_get_embedding_function(), metadata=HNSW_METADATA)
+                _COLLECTIONS[name] = collection
+    return collection
+
+def _embed_query(query_text: str) -> np.ndarray:
+    vector = np.asarray(_get_embedding_function()([query_text])[0], dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+def _evict_expired_queries(category_cache: OrderedDict, now: float, cache_ttl_s: float):
+    # Entries are kept in least-recently-used order, not insertion order, so every entry has to be checked.
+    for key in [key for key, entry in category_cache.items() if now - entry[0] >= cache_ttl_s]:
+        del category_cache[key]
+
+def _invalidate_query_cache(category: str):
+    with _QCACHE_LOCK:
+        _QCACHE.pop(category, None)
+
+def _content_id(category: str, content: str) -> str:
+    # All categories share one collection, so the category is part of the hash: the same paragraph
+    # scraped into two categories stays two documents.
+    return hashlib.blake2b(f"{category}\0{content}".encode("utf-8"), digest_size=16).hexdigest()
+
+def embed_information(contents: list[str], category: str, metadatas: Optional[list[dict]] = None, batch_size: int = CHROMA_ADD_BATCH_SIZE) -> list[str]:
+    """Stores contents under content-addressable ids, embedding only the ones not already in the VDB.
+
+    Returns the ids of the stored contents in order (including those that were already present), so a
+    repeat scrape of unchanged text costs one id lookup instead of a round of embeddings.
+    """
+    collection = _coll(DOCUMENTS_COLLECTION)
+
+    if not contents:
+        log.warning("Contents cannot be empty. No documents added.")
+        return []
 
+    ids_to_add = [_content_id(category, content) for content in contents]
+    metadatas_to_add = [{**metadata, "category": category} for metadata in (metadatas or [{}] * len(contents))]
+
+    # Chroma rejects writes above its max batch size, and very large single writes are slower than a few
+    # mid-sized ones, so both the lookup and the writes go in fixed-size batches.
+    batch_size = max(1, min(batch_size, _get_client().get_max_batch_size()))
+    first_positions = {doc_id: i for i, doc_id in reversed(list(enumerate(ids_to_add)))}
+    unique_ids = list(first_positions)
+    existing_ids = set()
+    for start in range(0, len(unique_ids), batch_size):
+        existing_ids.update(collection.get(ids=unique_ids[start:start + batch_size], include=[])["ids"])
+    new_positions = sorted(i for doc_id, i in first_positions.items() if doc_id not in existing_ids)
+
+    stored_ids = set(existing_ids)
+    for start in range(0, len(new_positions), batch_size):
+        batch = new_positions[start:start + batch_size]
+        documents = [contents[i] for i in batch]
+        try:
+            # Embedding the whole batch up front keeps the model call out of Chroma's write path and
+            # lets the model batch it (on the GPU when sentence-transformers has one).
+            # Chroma stores float32 vectors, so hand them over as one float32 matrix rather than lists of floats.
+            embeddings = np.asarray(_get_embedding_function()(documents), dtype=np.float32)
+            collection.upsert(
+                documents=documents,
+                embeddings=embeddings,
+                metadatas=[metadatas_to_add[i] for i in batch],
+                ids=[ids_to_add[i] for i in batch]
+            )
+        except Exception as e:
+            log.error("Error adding documents to category '%s' (%d of %d new documents added before the failure): %s",
+                      category, start, len(new_positions), e)
+            break
+        stored_ids.update(ids_to_add[i] for i in batch)
+
+    if len(stored_ids) > len(existing_ids):
+        _invalidate_query_cache(category)
+
+    # Callers map the result back to their inputs by position, so stop at the first content that was not stored.
+    added_ids = []
+    for doc_id in ids_to_add:
+        if doc_id not in stored_ids:
+            break
+        added_ids.append(doc_id)
+
+    log.debug("Added %d documents to category '%s' (%d already present).",
+              len(stored_ids) - len(existing_ids), category, len(existing_ids))
+    return added_ids
+
+def query_information(query_text: str, category: str, similarity_threshold: float = QUERY_CACHE_SIMILARITY, cache_ttl_s: float = QUERY_CACHE_TTL_S) -> dict:
     if not query_text:
-        print("Query text cannot be empty.")
+        log.warning("Query text cannot be empty.")
         return {"error": "Query text cannot be empty", "documents": [[]], "distances": [[]], "metadatas": [[]], "ids": [[]]}
 
-    results = collection.query(
-        query_texts=[query_text],
+    now = time.monotonic()
+    query_key = hashlib.sha256(query_text.encode("utf-8")).hexdigest()
+    with _QCACHE_LOCK:
+        category_cache = _QCACHE.setdefault(category, OrderedDict())
+        _evict_expired_queries(category_cache, now, cache_ttl_s)
+        exact_hit = category_cache.get(query_key)
+        if exact_hit is not None:
+            category_cache.move_to_end(query_key)
+    if exact_hit is not None:
+        log.debug("Query cache hit (exact) in category '%s' for '%s'.", category, query_text)
+        return exact_hit[2]
+
+    query_vector = _embed_query(query_text)
+    with _QCACHE_LOCK:
+        cached_keys = list(category_cache)
+        cached_entries = list(category_cache.values())
+    if cached_entries:
+        similarities = np.stack([entry[1] for entry in cached_entries]) @ query_vector
+        best = int(np.argmax(similarities))
+        if similarities[best] >= similarity_threshold:
+            with _QCACHE_LOCK:
+                if cached_keys[best] in category_cache:
+                    category_cache.move_to_end(cached_keys[best])
+            log.debug("Query cache hit (similarity %.3f) in category '%s' for '%s'.", similarities[best], category, query_text)
+            return cached_entries[best][2]
+
+    results = _coll(DOCUMENTS_COLLECTION).query(
+        query_embeddings=query_vector[np.newaxis, :],
         n_results=5,
+        where={"category": category},
         include=['documents', 'distances', 'metadatas']
     )
+
+    with _QCACHE_LOCK:
+        category_cache[query_key] = (now, query_vector, results)
+        if len(category_cache) > QUERY_CACHE_MAX_ENTRIES:
+            category_cache.popitem(last=False)
     
-    print(f"Query results from '{collection_name}' for '{query_text}': {results}")
+    log.debug("Query in category '%s' for '%s' returned ids %s.", category, query_text, results["ids"][0])
     return results
 
+def _url_digest(url: str) -> bytes:
+    return hashlib.sha256(url.encode("utf-8")).digest()
+
+def _mark_url_indexed(url: str):
+    url_digest = _url_digest(url)
+    # The rows are only ever fetched by id, so they carry a constant one-dimensional vector instead of an embedding.
+    _coll(URLS_COLLECTION).upsert(ids=[url_digest.hex()], embeddings=[[1.0]], documents=[url])
+    _SEEN_URLS.add(url_digest)
+
+def _record_page(url: str, stored_chunks: int, total_chunks: int):
+    # A partially stored page is not marked, so the next scrape request retries it instead of skipping it.
+    if stored_chunks == total_chunks:
+        _mark_url_indexed(url)
+    elif stored_chunks:
+        log.warning("Only %d of %d chunks from %s were stored; it will be scraped again when requested.",
+                    stored_chunks, total_chunks, url)
+
+def is_url_indexed(url: str) -> bool:
+    url_digest = _url_digest(url)
+    if url_digest in _SEEN_URLS:
+        return True
+
+    # Only URLS_COLLECTION counts: document rows with a matching source_url may belong to a partially stored page.
+    if _coll(URLS_COLLECTION).get(ids=[url_digest.hex()], include=[])["ids"]:
+        _SEEN_URLS.add(url_digest)
+        return True
+    return False
+
+def _canonical_encoding(encoding: str) -> Optional[str]:
+    try:
+        return codecs.lookup(encoding).name
+    except LookupError:
+        return None
+
+class _ParagraphExtractor:
+    """Incremental HTML parser that collects the text of each <p> as soon as it closes.
+
+    Stops accepting input after max_bytes, so a huge page is truncated instead of read in full. The page is
+    decoded by lxml in C with the charset declared by the server, else a <meta> charset, else UTF-8.
+    """
+
+    def __init__(self, url: str, max_bytes: int = SCRAPE_MAX_BYTES, encoding: Optional[str] = None):
+        self._url = url
+        self._encoding = encoding
+        self._max_bytes = max_bytes
+        # Created once the start of the page (up to SCRAPE_META_SNIFF_BYTES or </head>) has arrived, so a
+        # <meta> charset can be looked for; network reads can be much shorter than that.
+        self._parser: Optional[etree.HTMLPullParser] = None
+        self._head = bytearray()
+        self._bytes_left = max_bytes
+        self.paragraphs = []
+
+    def feed(self, html_chunk: bytes) -> bool:
+        """Parses a chunk of the page; returns False if it had to be cut at the size cap and the rest should be skipped."""
+        truncated = len(html_chunk) > self._bytes_left
+        if truncated:
+            log.warning("Page at %s exceeds %d bytes; only the first %d bytes are used.", self._url, self._max_bytes, self._max_bytes)
+        html_chunk = html_chunk[:self._bytes_left]
+        self._bytes_left -= len(html_chunk)
+        if self._parser is None:
+            self._head += html_chunk
+            if len(self._head) < SCRAPE_META_SNIFF_BYTES and b"</head" not in self._head.lower():
+                return not truncated
+            self._start_parser()
+        else:
+            self._parser.feed(html_chunk)
+        self._drain_events()
+        return not truncated
+
+    def close(self) -> list[str]:
+        if self._parser is None and self._head:
+            self._start_parser()
+        if self._parser is not None:
+            self._parser.close()
+            self._drain_events()
+        return self.paragraphs
+
+    def _start_parser(self):
+        self._parser = self._create_parser(bytes(self._head))
+        self._parser.feed(bytes(self._head))
+        self._head = bytearray()
+
+    def _create_parser(self, page_start: bytes) -> etree.HTMLPullParser:
+        # Without an encoding lxml decodes as Latin-1, so an encoding is always chosen here. A charset lxml
+        # does not know (e.g. "latin-1") is retried under Python's canonical name before moving on.
+        match = _META_CHARSET_RE.search(page_start[:SCRAPE_META_SNIFF_BYTES])
+        meta_encoding = match.group(1).decode("ascii") if match else None
+        for encoding in filter(None, (self._encoding, meta_encoding)):
+            for name in filter(None, (encoding, _canonical_encoding(encoding))):
+                try:
+                    return etree.HTMLPullParser(events=('end',), tag='p', encoding=name)
+                except LookupError:
+                    continue
+            log.debug("Unknown page encoding %r; ignoring it.", encoding)
+        return etree.HTMLPullParser(events=('end',), tag='p', encoding="utf-8")
+
+    def _drain_events(self):
+        for _, element in self._parser.read_events():
+            self.paragraphs.append("".join(element.itertext()).strip())
+            # The paragraph's text has been taken, so release its subtree and everything parsed before it.
+            element.clear(keep_tail=True)
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+
+def _charset_from_content_type(content_type: Optional[str]) -> Optional[str]:
+    # Only an explicit charset counts: requests' response.encoding falls back to ISO-8859-1 for any text/* type.
+    match = _CHARSET_RE.search(content_type or "")
+    return match.group(1) if match else None
+
+def _extract_paragraphs(url: str, html_chunks: Iterable[bytes], encoding: Optional[str] = None) -> list[str]:
+    extractor = _ParagraphExtractor(url, encoding=encoding)
+    for html_chunk in html_chunks:
+        if not extractor.feed(html_chunk):
+            break
+    return extractor.close()
+
 def scrape_and_embed_website(url: str) -> list[str]:
     try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-        response = requests.get(url, headers=headers, timeout=10)
-        response.raise_for_status()
+        with _HTTP.get(url, timeout=SCRAPE_TIMEOUT_S, stream=True) as response:
+            response.raise_for_status()
+            paragraphs = _extract_paragraphs(url, response.iter_content(chunk_size=SCRAPE_CHUNK_BYTES),
+                                             encoding=_charset_from_content_type(response.headers.get("Content-Type")))
     except requests.exceptions.RequestException as e:
-        print(f"Error fetching URL {url}: {e}")
+        log.error("Error fetching URL %s: %s", url, e)
+        return []
+    except etree.LxmlError as e:
+        log.error("Error parsing HTML from %s: %s", url, e)
         return []
 
-    soup = BeautifulSoup(response.content, 'html.parser')
-    paragraphs = [p.get_text(strip=True) for p in soup.find_all('p')]
-    chunks = [p for p in paragraphs if p]
-
-    if not chunks:
-        print(f"No text content found or extracted from paragraphs at {url}.")
+    page = _prepare_page(url, paragraphs)
+    if page is None:
         return []
+    category, chunks, metadatas_to_add = page
 
-    parsed_url = urlparse(url)
-    hostname = parsed_url.hostname
-    original_hostname_for_meta = hostname if hostname else "unknown_host"
+    ids_to_add = embed_information(chunks, category, metadatas=metadatas_to_add)
+    _record_page(url, len(ids_to_add), len(chunks))
 
+    log.debug("Embedded %d chunks from %s into category '%s'.", len(ids_to_add), url, category)
+    return ids_to_add
+
+def _sanitize_category(hostname: Optional[str]) -> str:
+    """Derives the VDB category for a hostname: drop 'www.' and the TLD, then make it a valid Chroma name."""
     if not hostname:
         category_name_base = "unknown_website_host"
     else:
         if hostname.startswith("www."):
             hostname = hostname[len("www."):]
-        
+
         name_parts = hostname.split('.')
         if len(name_parts) > 1:
             category_name_base = ".".join(name_parts[:-1])
         else:
             category_name_base = name_parts[0]
-    
-    category = re.sub(r'[^a-zA-Z0-9_-]+', '_', category_name_base)
+
+    category = _CATEGORY_SANITIZE_RE.sub('_', category_name_base)
     category = category.strip('_')
 
     if len(category) > 60:
@@ -100,38 +428,142 @@ def scrape_and_embed_website(url: str) -> list[str]:
 
     if not category:
         category = "default_scraped_content"
+    return category
 
-    client = chromadb.Client()
-    collection = client.get_or_create_collection(name=category)
+def _merge_paragraphs(paragraphs: list[str], target_chars: int = CHUNK_TARGET_CHARS) -> list[str]:
+    """Greedily joins consecutive paragraphs into chunks of up to target_chars; longer paragraphs stay whole."""
+    chunks = []
+    buffer = ""
+    for paragraph in paragraphs:
+        if buffer and len(buffer) + 1 + len(paragraph) > target_chars:
+            chunks.append(buffer)
+            buffer = paragraph
+        else:
+            buffer = f"{buffer} {paragraph}" if buffer else paragraph
+    if buffer:
+        chunks.append(buffer)
+    return chunks
 
-    documents_to_add = []
-    ids_to_add = []
-    metadatas_to_add = []
+def _prepare_page(url: str, paragraphs: list[str]) -> Optional[tuple[str, list[str], list[dict]]]:
+    """Turns a page's paragraphs into (category, chunks, metadatas), or None if it has no text."""
+    # Drop repeated boilerplate (nav, footer, cookie banners) so it is only embedded once; keeps first-seen order.
+    # Short paragraphs (crumbs, "Read more") are then merged so each embedding covers a meaningful span of text.
+    chunks = _merge_paragraphs(list(dict.fromkeys(p for p in paragraphs if p)))
 
-    for i, chunk_content in enumerate(chunks):
-        doc_id = str(uuid.uuid4())
-        documents_to_add.append(chunk_content)
-        ids_to_add.append(doc_id)
-        metadatas_to_add.append({
+    if not chunks:
+        log.warning("No text content found or extracted from paragraphs at %s.", url)
+        return None
+
+    hostname = urlparse(url).hostname
+    # Every row of the page references these same string objects; interning also shares the hostname and
+    # category across pages of one site, which are otherwise rebuilt for each URL.
+    url = sys.intern(url)
+    original_hostname_for_meta = sys.intern(hostname if hostname else "unknown_host")
+    category = sys.intern(_sanitize_category(hostname))
+
+    metadatas_to_add = [
+        {
             "source_url": url,
             "chunk_index": i,
             "original_hostname": original_hostname_for_meta
-        })
+        }
+        for i in range(len(chunks))
+    ]
+    return category, chunks, metadatas_to_add
 
-    if not documents_to_add:
-        print(f"No valid chunks to embed from {url}.")
-        return []
+def _get_scrape_session() -> aiohttp.ClientSession:
+    """The aiohttp session for the running event loop, kept open so repeat scrapes reuse pooled connections."""
+    global _SCRAPE_SESSION
+    loop = asyncio.get_running_loop()
+    if _SCRAPE_SESSION is None or _SCRAPE_SESSION.closed or _SCRAPE_SESSION.loop is not loop:
+        connector = aiohttp.TCPConnector(limit=SCRAPE_MAX_CONNECTIONS)
+        timeout = aiohttp.ClientTimeout(total=SCRAPE_TIMEOUT_S)
+        _SCRAPE_SESSION = aiohttp.ClientSession(headers=SCRAPE_HEADERS, connector=connector, timeout=timeout)
+    return _SCRAPE_SESSION
+
+async def close_scrape_session():
+    """Closes the async scraper's session; call it before the event loop that used it shuts down."""
+    global _SCRAPE_SESSION
+    if _SCRAPE_SESSION is not None and not _SCRAPE_SESSION.closed:
+        await _SCRAPE_SESSION.close()
+    _SCRAPE_SESSION = None
+
+async def _fetch_paragraphs(session: aiohttp.ClientSession, url: str) -> list[str]:
+    # Same retry policy as the requests session: connection failures and timeouts only, not HTTP errors.
+    for attempt in range(SCRAPE_RETRIES + 1):
+        try:
+            async with session.get(url) as response:
+                response.raise_for_status()
+                extractor = _ParagraphExtractor(url, encoding=response.charset)
+                async for html_chunk in response.content.iter_chunked(SCRAPE_CHUNK_BYTES):
+                    if not extractor.feed(html_chunk):
+                        break
+            return extractor.close()
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+            if attempt == SCRAPE_RETRIES:
+                raise
+            log.debug("Retrying %s after %s", url, e or "a timeout")
+            await asyncio.sleep(SCRAPE_RETRY_BACKOFF_S * 2 ** attempt)
+
+async def scrape_and_embed_websites_async(urls: list[str]) -> dict[str, list[str]]:
+    """Fetches all URLs concurrently, then embeds their chunks with one batched write per category.
+
+    Returns the stored document ids per URL (empty for pages that failed or had no text).
+    """
+    session = _get_scrape_session()
+    fetched = await asyncio.gather(*(_fetch_paragraphs(session, url) for url in urls), return_exceptions=True)
+
+    ids_by_url = {url: [] for url in urls}
+    pages_by_category: dict[str, list[tuple[str, list[str], list[dict]]]] = {}
+    for url, paragraphs in zip(urls, fetched):
+        if isinstance(paragraphs, (aiohttp.ClientError, asyncio.TimeoutError)):
+            log.error("Error fetching URL %s: %s", url, str(paragraphs) or "request timed out")
+            continue
+        if isinstance(paragraphs, etree.LxmlError):
+            log.error("Error parsing HTML from %s: %s", url, paragraphs)
+            continue
+        if isinstance(paragraphs, BaseException):
+            raise paragraphs
+        page = _prepare_page(url, paragraphs)
+        if page is not None:
+            category, chunks, metadatas = page
+            pages_by_category.setdefault(category, []).append((url, chunks, metadatas))
+
+    # Embedding and the Chroma writes block, so they run in a worker thread rather than on the event loop.
+    for category, pages in pages_by_category.items():
+        ids_by_url.update(await asyncio.to_thread(_embed_pages, category, pages))
 
-    collection.add(
-        documents=documents_to_add,
-        metadatas=metadatas_to_add,
-        ids=ids_to_add
+    return ids_by_url
+
+def _embed_pages(category: str, pages: list[tuple[str, list[str], list[dict]]]) -> dict[str, list[str]]:
+    """Stores the chunks of several pages of one category in a single batched write; returns the ids per URL."""
+    added_ids = embed_information(
+        [chunk for _, chunks, _ in pages for chunk in chunks],
+        category,
+        metadatas=[metadata for _, _, metadatas in pages for metadata in metadatas]
     )
+    # embed_information returns the ids of the documents it stored, in order, so they map back page by page.
+    ids_by_url = {}
+    offset = 0
+    for url, chunks, _ in pages:
+        ids_by_url[url] = added_ids[offset:offset + len(chunks)]
+        offset += len(chunks)
+        _record_page(url, len(ids_by_url[url]), len(chunks))
+        if ids_by_url[url]:
+            log.debug("Embedded %d chunks from %s into category '%s'.", len(ids_by_url[url]), url, category)
+    return ids_by_url
 
-    print(f"Successfully embedded {len(documents_to_add)} chunks from {url} into category '{category}'.")
-    return ids_to_add
+def scrape_and_embed_websites(urls: list[str]) -> dict[str, list[str]]:
+    """Synchronous wrapper around scrape_and_embed_websites_async for callers without an event loop."""
+    async def scrape_once() -> dict[str, list[str]]:
+        try:
+            return await scrape_and_embed_websites_async(urls)
+        finally:
+            await close_scrape_session()
+    return asyncio.run(scrape_once())
 
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.DEBUG, format="%(levelname)s: %(message)s")
     target_url = "https://bernatbc.tk" 
     print(f"Attempting to scrape and embed content from: {target_url}")
     
@@ -141,24 +573,7 @@ if __name__ == '__main__':
         print(f"\nSuccessfully scraped and embedded {len(embedded_doc_ids)} chunks from {target_url}.")
         print(f"Document IDs: {embedded_doc_ids}")
 
-        parsed_url = urlparse(target_url)
-        hostname = parsed_url.hostname
-        if hostname.startswith("www."):
-            hostname = hostname[len("www."):]
-        name_parts = hostname.split('.')
-        if len(name_parts) > 1:
-            category_name_base = ".".join(name_parts[:-1])
-        else:
-            category_name_base = name_parts[0]
-        
-        category = re.sub(r'[^a-zA-Z0-9_-]+', '_', category_name_base)
-        category = category.strip('_')
-        if len(category) > 60: category = category[:60]
-        if len(category) < 3:
-            category = f"{category}_web" if category else "scraped_data"
-            while len(category) < 3: category += "_"
-        category = category[:63]
-        if not category: category = "default_scraped_content"
+        category = _sanitize_category(urlparse(target_url).hostname)
 
         print(f"\nTo query this information, use category: '{category}'")
     else: